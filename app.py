@@ -3,51 +3,120 @@ US Programs Heat Map with Device Type Filters — Render Deployment Version
 ========================================================================
 """
 
+import functools
+import json
 import os
+import tempfile
+import time
+
 import pandas as pd
-from supabase import create_client, Client
-import plotly.express as px
+from supabase import create_client, Client, ClientOptions
 import dash
-from dash import dcc, html, Input, Output, callback
+from dash import dcc, html, Input, Output, State, callback, clientside_callback
 import plotly.graph_objects as go
+from sqlalchemy import create_engine
 
 # ---------------------------------------------------
 # 1.  Set up Supabase connection
 # ---------------------------------------------------
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Optional Postgres connection string for the Supavisor pooler
+SUPABASE_POOL_URL = os.getenv("SUPABASE_POOL_URL")
 
 if not (SUPABASE_URL and SUPABASE_KEY):
     raise ValueError("Supabase credentials not found in environment variables.")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL, SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=30)
+)
+
+# When a pooler URL is set, data loads read Postgres directly instead of going through PostgREST
+db_engine = None
+if SUPABASE_POOL_URL:
+    db_engine = create_engine(
+        SUPABASE_POOL_URL,
+        pool_size=3,
+        max_overflow=2,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_timeout=30,
+    )
+
+# On-disk cache so restarts within the TTL skip the Supabase roundtrips.
+# Defaults to a directory owned by the app rather than the shared system temp dir.
+DATA_CACHE_DIR = os.getenv("DATA_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data_cache"))
+DATA_CACHE_TTL = int(os.getenv("DATA_CACHE_TTL", 3600))
 
 # ---------------------------------------------------
 # 2.  Data loading with error handling
 # ---------------------------------------------------
+def _cached_fetch(cache_name, sql, query, ttl=DATA_CACHE_TTL):
+    """Run sql on db_engine (or the equivalent Supabase query without one),
+    reusing an on-disk copy younger than ttl seconds"""
+    # Plain JSON (with a table schema to keep dtypes), never pickle: loading must not run code
+    cache_path = os.path.join(DATA_CACHE_DIR, f"{cache_name}.json")
+    try:
+        if time.time() - os.path.getmtime(cache_path) < ttl:
+            return pd.read_json(cache_path, orient='table')
+    except Exception:
+        # Missing or unreadable cache file; fall through to a fresh fetch
+        pass
+
+    if db_engine is not None:
+        frame = pd.read_sql(sql, db_engine)
+    else:
+        frame = pd.DataFrame(query.execute().data)
+    if not frame.empty:
+        tmp_path = None
+        try:
+            os.makedirs(DATA_CACHE_DIR, mode=0o700, exist_ok=True)
+            # Write beside the target and swap it in, so concurrent gunicorn workers
+            # never leave or read a half-written file
+            fd, tmp_path = tempfile.mkstemp(dir=DATA_CACHE_DIR, prefix=f".{cache_name}.", suffix=".tmp")
+            os.close(fd)
+            frame.to_json(tmp_path, orient='table', index=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not cache {cache_name}: {e}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return frame
+
 def load_data():
     """Load data from Supabase with error handling"""
     try:
         # Get device categories
-        device_response = supabase.table("device_categories").select("*").execute()
-        device_categories = pd.DataFrame(device_response.data)
-        device_dict = dict(zip(device_categories['id'], device_categories['name']))
+        device_categories = _cached_fetch(
+            "device_categories__id_name",
+            "SELECT id, name FROM device_categories",
+            supabase.table("device_categories").select("id,name")
+        )
+        # Narrow numeric ids; text/UUID keys are left alone (reindex works with any key)
+        if pd.api.types.is_numeric_dtype(device_categories['id']):
+            device_categories['id'] = pd.to_numeric(device_categories['id'], downcast='integer')
+        device_map = device_categories.set_index('id')['name']
 
-        # Get programs data
-        programs_response = supabase.table("programs").select("*").execute()
-        programs_data = programs_response.data
+        # Get program counts per (state, device category), aggregated in Postgres
+        # (see supabase/migrations); one row per pair instead of one per program
+        df_programs = _cached_fetch(
+            "program_counts_by_state_device",
+            "SELECT * FROM program_counts_by_state_device()",
+            supabase.rpc("program_counts_by_state_device")
+        )
 
-        if not programs_data:
-            raise ValueError("No rows returned from Supabase programs table.")
+        if df_programs.empty:
+            raise ValueError("No rows returned from program_counts_by_state_device.")
 
-        df_programs = pd.DataFrame(programs_data)
-        return df_programs, device_dict
+        return df_programs, device_map
     except Exception as e:
         print(f"Error loading data: {e}")
         # Return empty data for graceful degradation
-        return pd.DataFrame(), {}
+        return pd.DataFrame(), pd.Series(dtype=object)
 
-df_programs, device_dict = load_data()
+df_programs, device_map = load_data()
 
 # ---------------------------------------------------
 # 3.  Process and prepare data
@@ -75,6 +144,10 @@ state_to_region = {
     'RI': 'Northeast', 'CT': 'Northeast', 'NY': 'Northeast'
 }
 
+# Same mapping as a categorical Series, built once for reindex lookups in callbacks
+region_by_state = pd.Series(state_to_region, name='region').astype('category')
+us_states = frozenset(state_to_region)
+
 # Region center coordinates for labels
 region_centers = {
     'Southwest': {'lat': 34, 'lon': -106},
@@ -86,34 +159,93 @@ region_centers = {
 }
 
 # Process data if available
-device_options = []
+all_devices = ()
+all_regions = tuple(sorted(set(state_to_region.values())))
 df_us_programs = pd.DataFrame()
 
-if not df_programs.empty and device_dict:
-    # Filter for US states only and add device names and regions
-    df_us_programs = df_programs[df_programs['state_province'].str.len() == 2].copy()
-    df_us_programs['device_name'] = df_us_programs['device_category_id'].map(device_dict)
+if not df_programs.empty and not device_map.empty:
+    # Filter for US states only (the SQL function already drops non two-letter codes)
+    # and add device names and regions
+    df_us_programs = df_programs[df_programs['state_province'].isin(us_states)].copy()
+    if pd.api.types.is_numeric_dtype(df_us_programs['device_category_id']):
+        df_us_programs['device_category_id'] = pd.to_numeric(df_us_programs['device_category_id'],
+                                                             downcast='integer')
+    df_us_programs['device_name'] = device_map.reindex(df_us_programs['device_category_id']).values
     df_us_programs['region'] = df_us_programs['state_province'].map(state_to_region)
     
+    # Low-cardinality labels as categoricals so filtering and grouping run on integer codes
+    for column in ('state_province', 'device_name', 'region'):
+        df_us_programs[column] = df_us_programs[column].astype('category')
+    df_us_programs['program_count'] = pd.to_numeric(df_us_programs['program_count'], downcast='integer')
+    
     # Get unique device types for filter options
-    device_options = [{'label': device_name, 'value': device_name} 
-                     for device_name in sorted(df_us_programs['device_name'].dropna().unique())]
+    all_devices = tuple(sorted(df_us_programs['device_name'].dropna().unique()))
+
+# Dropdown options, built once and reused by the layout and the select-all callbacks
+device_options = tuple({'label': device_name, 'value': device_name} for device_name in all_devices)
+region_options = tuple({'label': region, 'value': region} for region in all_regions)
 
 # ---------------------------------------------------
 # 4.  Create Dash App
 # ---------------------------------------------------
+def _style_map(fig):
+    """Apply the geo styling and margins shared by every map figure"""
+    fig.update_geos(
+        lakecolor="white",
+        landcolor="#E5E5E5",
+        showcountries=False,
+        showlakes=True,
+    )
+    # A constant uirevision lets Plotly.js diff the new figure in, keeping zoom/pan
+    fig.update_layout(margin=dict(l=0, r=0, t=60, b=0), uirevision='constant')
+    return fig
+
+def _empty_map(title):
+    """Blank USA choropleth with the given title, as plain JSON data"""
+    fig = go.Figure()
+    fig.add_trace(go.Choropleth(
+        locations=[],
+        z=[],
+        locationmode="USA-states",
+        colorscale="Greens"
+    ))
+    fig.update_geos(scope="usa")
+    fig.update_layout(title=title)
+    return json.loads(_style_map(fig).to_json())
+
+# Outputs for the startup, no-data and nothing-selected cases, built once
+loading_figure = _empty_map("Loading programs...")
+no_data_figure = _empty_map("No data available")
+no_data_summary = [html.P("No data available")]
+empty_selection_figure = _empty_map("No data available for selected filters")
+empty_selection_summary = [
+    html.H3("Summary Statistics"),
+    html.P("No programs match the selected filters.")
+]
+
 # Initialize the Dash app
 app = dash.Dash(__name__)
 
 # This is important for Render deployment
 server = app.server
 
+# Load failures are known at import time, so the message is rendered straight into the layout
+if df_programs.empty or device_map.empty:
+    error_message = html.Div([
+        html.H3("⚠️ Unable to load data"),
+        html.P("Please check your Supabase connection and try again later."),
+        html.P("Make sure SUPABASE_URL and SUPABASE_KEY environment variables are set correctly.")
+    ])
+else:
+    error_message = ""
+
 app.layout = html.Div([
     html.H1("US Energy Incentive Programs Heat Map", 
             style={'textAlign': 'center', 'marginBottom': 30}),
     
     # Show error message if no data
-    html.Div(id='error-message', style={'textAlign': 'center', 'color': 'red', 'marginBottom': 20}),
+    html.Div(error_message, id='error-message',
+             style={'textAlign': 'center', 'color': 'red', 'marginBottom': 20}),
     
     html.Div([
         html.Div([
@@ -121,7 +253,7 @@ app.layout = html.Div([
             dcc.Dropdown(
                 id='device-filter',
                 options=device_options,
-                value=[option['value'] for option in device_options],
+                value=all_devices,
                 multi=True,
                 placeholder="Select device types...",
                 style={'marginBottom': 20}
@@ -132,9 +264,8 @@ app.layout = html.Div([
             html.Label("Filter by Region:", style={'fontWeight': 'bold', 'marginBottom': 10}),
             dcc.Dropdown(
                 id='region-filter',
-                options=[{'label': region, 'value': region} 
-                        for region in sorted(set(state_to_region.values())) if region],
-                value=list(set(state_to_region.values())),
+                options=region_options,
+                value=all_regions,
                 multi=True,
                 placeholder="Select regions...",
                 style={'marginBottom': 20}
@@ -153,7 +284,19 @@ app.layout = html.Div([
                    style={'marginBottom': 10}),
     ], style={'textAlign': 'center'}) if device_options else html.Div(),
     
-    dcc.Graph(id='programs-map', style={'height': '700px'}),
+    # Whether the map is on screen; kept up to date by an IntersectionObserver
+    dcc.Store(id='map-visible', data=True),
+    # Selection the map and summary currently show, so scrolling back only re-renders if stale
+    dcc.Store(id='rendered-selection'),
+    
+    # Plain wrapper for the observer: dcc.Graph swaps its DOM node once the plotly bundle loads
+    html.Div(
+        # Start from a prebuilt empty map instead of Plotly's blank axes until update_map answers
+        dcc.Graph(id='programs-map',
+                  figure=no_data_figure if df_us_programs.empty else loading_figure,
+                  style={'height': '700px'}),
+        id='map-container'
+    ),
     
     html.Div(id='summary-stats', style={'marginTop': 20, 'padding': 20, 'backgroundColor': '#f9f9f9'})
 ])
@@ -161,213 +304,237 @@ app.layout = html.Div([
 # ---------------------------------------------------
 # 5.  Callback functions with error handling
 # ---------------------------------------------------
-@callback(
-    Output('error-message', 'children'),
-    Input('programs-map', 'id')  # Dummy input to trigger on load
-)
-def show_error_message(_):
-    if df_programs.empty or not device_dict:
-        return html.Div([
-            html.H3("⚠️ Unable to load data"),
-            html.P("Please check your Supabase connection and try again later."),
-            html.P("Make sure SUPABASE_URL and SUPABASE_KEY environment variables are set correctly.")
-        ])
-    return ""
+def _select_all_js(select_all_id):
+    """Clientside callback body: every option's value when select_all_id fired, else an empty selection"""
+    # Values are read from the dropdown's options in the browser so no data is embedded in the script
+    return """
+    function(selectAll, clearAll, options) {
+        const triggered = dash_clientside.callback_context.triggered;
+        if (!triggered.length) {
+            return dash_clientside.no_update;
+        }
+        if (triggered[0].prop_id !== '%s.n_clicks') {
+            return [];
+        }
+        return (options || []).map(function(option) { return option.value; });
+    }
+    """ % select_all_id
 
-@callback(
+# Select-All / Clear-All only copy values already in the dropdowns, so they run in the browser
+clientside_callback(
+    _select_all_js('select-all-devices'),
     Output('device-filter', 'value'),
     [Input('select-all-devices', 'n_clicks'),
      Input('clear-all-devices', 'n_clicks')],
+    State('device-filter', 'options'),
     prevent_initial_call=True
 )
-def update_device_selection(select_all, clear_all):
-    if not device_options:
-        return []
-    
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return dash.no_update
-    
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    
-    if button_id == 'select-all-devices':
-        return [option['value'] for option in device_options]
-    elif button_id == 'clear-all-devices':
-        return []
-    
-    return dash.no_update
 
-@callback(
+clientside_callback(
+    _select_all_js('select-all-regions'),
     Output('region-filter', 'value'),
     [Input('select-all-regions', 'n_clicks'),
      Input('clear-all-regions', 'n_clicks')],
+    State('region-filter', 'options'),
     prevent_initial_call=True
 )
-def update_region_selection(select_all, clear_all):
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return dash.no_update
+
+@functools.lru_cache(maxsize=128)
+def _aggregate_selection(devices_key, regions_key):
+    """Filter and aggregate the programs for one (devices, regions) selection.
+
+    The returned frames are shared through the cache, so callers must not modify them.
+    """
+    # Filter data based on selections with one combined mask
+    mask = (df_us_programs['device_name'].isin(devices_key)
+            & df_us_programs['region'].isin(regions_key))
+    filtered_df = df_us_programs.loc[mask]
+    
+    aggregates = {'total_programs': int(filtered_df['program_count'].sum())}
+    if aggregates['total_programs'] == 0:
+        return aggregates
+    
+    # Group once; every other breakdown is derived from these counts
+    # (observed=True keeps category combinations absent from the selection out of the result;
+    # sort=False skips sorting the full counts, and only the small results shown in order are sorted below)
+    counts = filtered_df.groupby(['region', 'state_province', 'device_name'],
+                                 observed=True, sort=False)['program_count'].sum()
+    
+    # Each state lies in one region, so (state, device) is already unique without the region level
+    state_device_counts = counts.droplevel('region').sort_index().reset_index(name='count')
+    state_totals = (counts.groupby(level='state_province', observed=True, sort=False).sum()
+                    .reset_index(name='programs'))
+    state_totals.columns = ['state', 'programs']
+    state_totals['state'] = state_totals['state'].astype(str)
+    
+    # Region and device marginals come from the much smaller region/device counts
+    # (sorted so hover device lines don't depend on the row order of the RPC result)
+    region_device = counts.groupby(level=['region', 'device_name'], observed=True, sort=False).sum().sort_index()
+    region_totals = region_device.groupby(level='region', observed=True, sort=False).sum()
+    device_breakdown = (region_device.groupby(level='device_name', observed=True, sort=False).sum()
+                        .sort_index().sort_values(ascending=False, kind='stable').reset_index(name='count'))
+    
+    # One hover body per region, built once per selection; states just look theirs up
+    region_device_counts = region_device.reset_index(name='count')
+    device_lines = (region_device_counts['device_name'].astype(str) + ': '
+                    + region_device_counts['count'].astype(str) + '<br>')
+    region_device_lines = device_lines.groupby(region_device_counts['region'], observed=True, sort=False).sum()
+    region_hover = {
+        region: (f"<b>{region} Region</b><br>Total Programs: {total}<br><br>"
+                 f"<b>By Device Type:</b><br>{region_device_lines.get(region, '')}")
+        for region, total in region_totals.items()
+    }
+    
+    aggregates.update({
+        'state_totals': state_totals,
+        'region_hover': region_hover,
+        'state_device_counts': state_device_counts,
+        'device_breakdown': device_breakdown,
+    })
+    return aggregates
+
+@functools.lru_cache(maxsize=128)
+def _render_map(devices_key, regions_key):
+    """Build the map figure (as plain JSON data) and summary for one (devices, regions) selection"""
+    aggregates = _aggregate_selection(devices_key, regions_key)
     
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    selected_regions = regions_key
+    total_programs = aggregates['total_programs']
     
-    if button_id == 'select-all-regions':
-        return list(set(state_to_region.values()))
-    elif button_id == 'clear-all-regions':
-        return []
+    if total_programs == 0:
+        return empty_selection_figure, empty_selection_summary
     
-    return dash.no_update
+    # Calculate statistics for filtered data
+    state_totals = aggregates['state_totals']
+    
+    # Every state here has programs in a selected region, so its region's hover body always exists
+    region_hover = aggregates['region_hover']
+    hover_text = region_by_state.reindex(state_totals['state']).map(region_hover).astype(object)
+    
+    fig = go.Figure(go.Choropleth(
+        locations=state_totals['state'].values,
+        z=state_totals['programs'].values,
+        locationmode="USA-states",
+        colorscale="Greens",
+        colorbar=dict(title="Number of Programs"),
+        customdata=hover_text.values.reshape(-1, 1),
+        hovertemplate='%{customdata[0]}<extra></extra>'
+    ))
+    fig.update_geos(scope="usa")
+    fig.update_layout(title=f"Programs for Selected Device Types ({total_programs} total programs)")
+    
+    # All region labels in one text trace
+    visible_regions = [region for region in region_centers if region in selected_regions]
+    fig.add_scattergeo(
+        lon=[region_centers[region]['lon'] for region in visible_regions],
+        lat=[region_centers[region]['lat'] for region in visible_regions],
+        text=visible_regions,
+        mode='text',
+        textfont=dict(size=14, color='black', family='Arial Black'),
+        showlegend=False,
+        hoverinfo='skip'
+    )
+    
+    total_states = len(state_totals)
+    total_regions = len(region_hover)
+    
+    device_breakdown = aggregates['device_breakdown'].set_index('device_name')['count']
+    
+    # Get programs by state (top 10)
+    # (ties keep alphabetical state order)
+    state_breakdown = (state_totals.set_index('state')['programs'].sort_index()
+                       .sort_values(ascending=False, kind='stable').head(10))
+    
+    # Get programs by state and device type
+    state_device_breakdown = aggregates['state_device_counts']
+    
+    summary_children = [
+        html.H3("Summary Statistics"),
+        html.P(f"Total Programs: {total_programs}"),
+        html.P(f"States with Programs: {total_states}"),
+        html.P(f"Regions with Programs: {total_regions}"),
+        html.H4("Programs by Device Type:"),
+        html.Ul([html.Li(f"{device}: {count}") for device, count in device_breakdown.items()]),
+        html.H4("Top 10 States by Program Count:"),
+        html.Ul([html.Li(f"{state}: {count}") for state, count in state_breakdown.items()]),
+        html.H4("Programs by State and Device Type:"),
+        html.Div([
+            html.Details([
+                html.Summary(f"{state} ({len(state_device_breakdown[state_device_breakdown['state_province'] == state])} device types)"),
+                html.Ul([
+                    html.Li(f"{row['device_name']}: {row['count']}")
+                    for _, row in state_device_breakdown[state_device_breakdown['state_province'] == state].iterrows()
+                ])
+            ], style={'marginBottom': '5px'})
+            for state in state_breakdown.index
+        ])
+    ]
+    
+    # Cache the figure already encoded to plain JSON types so responses skip Plotly's encoder
+    return json.loads(_style_map(fig).to_json()), summary_children
+
+# Watch the map container and push visibility changes into map-visible
+clientside_callback(
+    """
+    function(containerId) {
+        if (!window.IntersectionObserver) {
+            return dash_clientside.no_update;
+        }
+        const attach = function() {
+            const container = document.getElementById(containerId);
+            if (!container) {
+                window.requestAnimationFrame(attach);
+                return;
+            }
+            let visible = true;
+            new IntersectionObserver(function(entries) {
+                const isVisible = entries[entries.length - 1].isIntersecting;
+                if (isVisible !== visible) {
+                    visible = isVisible;
+                    dash_clientside.set_props('map-visible', {data: visible});
+                }
+            }).observe(container);
+        };
+        attach();
+        return dash_clientside.no_update;
+    }
+    """,
+    Output('map-visible', 'data'),
+    Input('map-container', 'id')
+)
 
 @callback(
     [Output('programs-map', 'figure'),
-     Output('summary-stats', 'children')],
+     Output('summary-stats', 'children'),
+     Output('rendered-selection', 'data')],
     [Input('device-filter', 'value'),
-     Input('region-filter', 'value')]
+     Input('region-filter', 'value'),
+     Input('map-visible', 'data')],
+    State('rendered-selection', 'data')
 )
-def update_map(selected_devices, selected_regions):
-    # Handle case where no data is available
-    if df_us_programs.empty:
-        fig = go.Figure()
-        fig.add_trace(go.Choropleth(
-            locations=[],
-            z=[],
-            locationmode="USA-states",
-            colorscale="Greens"
-        ))
-        fig.update_geos(scope="usa")
-        fig.update_layout(title="No data available")
-        return fig, [html.P("No data available")]
+def update_map(selected_devices, selected_regions, map_visible, rendered):
+    # Normalize the selection; it keys both the aggregation/render caches and rendered-selection
+    selection = None
+    if not df_us_programs.empty:
+        selection = {'selected_devices': sorted(set(selected_devices or ())),
+                     'selected_regions': sorted(set(selected_regions or ()))}
     
-    # Filter data based on selections
-    filtered_df = df_us_programs.copy()
+    # Don't build a figure nobody can see, and don't resend one that is already showing;
+    # scrolling back after a skipped update fires this again with the current selection
+    if not map_visible or (rendered is not None and rendered['selection'] == selection):
+        return dash.no_update, dash.no_update, dash.no_update
+    rendered = {'selection': selection}
     
-    if selected_devices:
-        filtered_df = filtered_df[filtered_df['device_name'].isin(selected_devices)]
-    else:
-        filtered_df = filtered_df.iloc[0:0]
-    
-    if selected_regions:
-        filtered_df = filtered_df[filtered_df['region'].isin(selected_regions)]
-    else:
-        filtered_df = filtered_df.iloc[0:0]
-    
-    # Calculate statistics for filtered data
-    if len(filtered_df) > 0:
-        state_totals = filtered_df.groupby('state_province').size().reset_index(name='programs')
-        state_totals.columns = ['state', 'programs']
-        state_totals['region'] = state_totals['state'].map(state_to_region)
-        
-        region_totals = filtered_df.groupby('region').size().reset_index(name='total_programs')
-        region_device_counts = filtered_df.groupby(['region', 'device_name']).size().reset_index(name='count')
-        
-        hover_texts = []
-        for _, state_row in state_totals.iterrows():
-            state = state_row['state']
-            region = state_row['region']
-            
-            if region and region in selected_regions:
-                region_total = region_totals[region_totals['region'] == region]['total_programs'].values
-                region_total = region_total[0] if len(region_total) > 0 else 0
-                
-                region_devices = region_device_counts[region_device_counts['region'] == region]
-                
-                hover_text = f"<b>{region} Region</b><br>"
-                hover_text += f"Total Programs: {region_total}<br><br>"
-                hover_text += "<b>By Device Type:</b><br>"
-                
-                for _, device_row in region_devices.iterrows():
-                    hover_text += f"{device_row['device_name']}: {device_row['count']}<br>"
-                
-                hover_texts.append(hover_text)
-            else:
-                hover_texts.append(f"<b>{state}</b><br>No data for selected filters")
-        
-        state_totals['hover_text'] = hover_texts
-        
-        fig = px.choropleth(
-            state_totals,
-            locations="state",
-            locationmode="USA-states",
-            color="programs",
-            color_continuous_scale="Greens",
-            scope="usa",
-            labels={"programs": "Number of Programs"},
-            title=f"Programs for Selected Device Types ({len(filtered_df)} total programs)",
-            hover_data={'hover_text': True, 'programs': False, 'state': False}
-        )
-        
-        fig.update_traces(hovertemplate='%{customdata[0]}<extra></extra>')
-        
-        for region, coords in region_centers.items():
-            if region in selected_regions:
-                fig.add_scattergeo(
-                    lon=[coords['lon']],
-                    lat=[coords['lat']],
-                    text=region,
-                    mode='text',
-                    textfont=dict(size=14, color='black', family='Arial Black'),
-                    showlegend=False,
-                    hoverinfo='skip'
-                )
-        
-        total_programs = len(filtered_df)
-        total_states = len(state_totals)
-        total_regions = len(region_totals)
-        
-        device_breakdown = filtered_df.groupby('device_name').size().sort_values(ascending=False)
-        
-        # Get programs by state (top 10)
-        state_breakdown = filtered_df.groupby('state_province').size().sort_values(ascending=False).head(10)
-        
-        # Get programs by state and device type
-        state_device_breakdown = filtered_df.groupby(['state_province', 'device_name']).size().reset_index(name='count')
-        
-        summary_children = [
-            html.H3("Summary Statistics"),
-            html.P(f"Total Programs: {total_programs}"),
-            html.P(f"States with Programs: {total_states}"),
-            html.P(f"Regions with Programs: {total_regions}"),
-            html.H4("Programs by Device Type:"),
-            html.Ul([html.Li(f"{device}: {count}") for device, count in device_breakdown.items()]),
-            html.H4("Top 10 States by Program Count:"),
-            html.Ul([html.Li(f"{state}: {count}") for state, count in state_breakdown.items()]),
-            html.H4("Programs by State and Device Type:"),
-            html.Div([
-                html.Details([
-                    html.Summary(f"{state} ({len(state_device_breakdown[state_device_breakdown['state_province'] == state])} device types)"),
-                    html.Ul([
-                        html.Li(f"{row['device_name']}: {row['count']}")
-                        for _, row in state_device_breakdown[state_device_breakdown['state_province'] == state].iterrows()
-                    ])
-                ], style={'marginBottom': '5px'})
-                for state in state_breakdown.index
-            ])
-        ]
-        
-    else:
-        fig = go.Figure()
-        fig.add_trace(go.Choropleth(
-            locations=[],
-            z=[],
-            locationmode="USA-states",
-            colorscale="Greens"
-        ))
-        fig.update_geos(scope="usa")
-        fig.update_layout(title="No data available for selected filters")
-        
-        summary_children = [
-            html.H3("Summary Statistics"),
-            html.P("No programs match the selected filters.")
-        ]
+    # Handle case where no data is available
+    if selection is None:
+        return no_data_figure, no_data_summary, rendered
     
-    fig.update_geos(
-        lakecolor="white",
-        landcolor="#E5E5E5",
-        showcountries=False,
-        showlakes=True,
-    )
-    fig.update_layout(margin=dict(l=0, r=0, t=60, b=0))
+    if not selection['selected_devices'] or not selection['selected_regions']:
+        return empty_selection_figure, empty_selection_summary, rendered
     
-    return fig, summary_children
+    fig, summary_children = _render_map(frozenset(selection['selected_devices']),
+                                        frozenset(selection['selected_regions']))
+    return fig, summary_children, rendered
 
 # ---------------------------------------------------
 # 6.  Run the app
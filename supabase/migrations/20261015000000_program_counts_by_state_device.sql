@@ -0,0 +1,18 @@
+-- Program counts per (state, device category), used by the dashboard in place
+-- of fetching every row of programs and grouping client-side.
+create or replace function public.program_counts_by_state_device()
+returns table (
+    state_province public.programs.state_province%type,
+    device_category_id public.programs.device_category_id%type,
+    program_count bigint
+)
+language sql
+stable
+as $$
+    select p.state_province, p.device_category_id, count(*) as program_count
+    from public.programs p
+    where length(p.state_province) = 2
+    group by 1, 2
+$$;
+
+grant execute on function public.program_counts_by_state_device() to anon, authenticated;